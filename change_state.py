@@ -7,44 +7,81 @@ import common
 
 logger, config, partitions = common.get_common('change_state')
 
-# Populate a hostlist with all AWS nodes
-hostlist = []
-for partition in partitions:
-    for nodegroup in partition['NodeGroups']:
-        hostlist.append(common.get_node_range(partition, nodegroup))
+# Populate a hostlist with all AWS nodes in a single flattened pass
+get_node_range = common.get_node_range
+hostlist = [get_node_range(partition, nodegroup)
+            for partition in partitions
+            for nodegroup in partition['NodeGroups']]
+
+# Retrieve nodes information using 'scontrol show node'. Slurm >= 20.11 can
+# emit JSON, which is parsed in C and avoids splitting every line in Python;
+# older versions fall back to the one-line-per-node text format
+nodes_states = {}  # node_name -> set of node states
+
+# Base states that carry the * suffix in the text format when a node is not
+# responding; flags such as CLOUD, DRAIN or POWER never do
+BASE_STATES = frozenset(('ALLOCATED', 'COMPLETING', 'DOWN', 'ERROR', 'FUTURE', 'IDLE', 'MIXED', 'UNKNOWN'))
 
-# Retrieve nodes information using 'scontrol show node'
 try:
-    arguments = ['show', 'node', ','.join(hostlist), '-o']
+    arguments = ['show', 'node', ','.join(hostlist), '--json']
     lines = common.run_scommand('scontrol', arguments)
-except Exception as e:
-    logger.critical('Failed to get nodes info - %s' %e)
-    sys.exit(1)
-
-def change_state(node_name, new_state, reason=None):
+    data = json.loads('\n'.join(lines))
+    for node in data['nodes']:
+        # The state field is an array of state names in recent Slurm releases,
+        # but a single +-joined string in the earlier --json-capable ones
+        state = node['state']
+        node_states = set(state.split('+')) if isinstance(state, str) else set(state)
+        # The text format marks a non-responding node by replacing the base
+        # state with a starred copy (DOWN*+CLOUD never contains DOWN): mirror
+        # that here so both formats match the same rules exactly once
+        if 'NOT_RESPONDING' in node_states:
+            for base in tuple(node_states & BASE_STATES):
+                node_states.discard(base)
+                node_states.add('%s*' %base)
+        nodes_states[node['name']] = node_states
+except Exception:
     try:
-        slurm_param = 'state=%s' %new_state
-        if reason is not None:
-            slurm_param += ' reason=%s' %reason
-        common.update_node(node_name, slurm_param)
-        logger.info('Set node %s to state %s' %(node_name, new_state))
+        arguments = ['show', 'node', ','.join(hostlist), '-o']
+        lines = common.run_scommand('scontrol', arguments)
+        # Single pass over the tokens: only NodeName and State are used, so
+        # there is no need to build a dict of every attribute
+        for line in lines:
+            node_name = None
+            node_states = None
+            for token in line.split(' '):
+                if token.startswith('NodeName='):
+                    node_name = token[9:]
+                elif token.startswith('State='):
+                    node_states = set(token[6:].split('+'))
+                    if node_name is not None:
+                        break
+            if node_name is not None and node_states is not None:
+                nodes_states[node_name] = node_states
     except Exception as e:
-        logger.error('Failed to set node %s to state %s - %s' %(node_name, new_state, e))
+        logger.critical('Failed to get nodes info - %s', e)
+        sys.exit(1)
+
+# Nodes to update, grouped by (new_state, reason) so that a single scontrol
+# call can update all nodes that require the same state change
+nodes_to_change = {}
 
-# Extract node details and change the state if required
-for line in lines:
-    line_split = [i for i in line.split(' ') if '=' in i]
-    node_attributes = {i.split('=')[0]: i.split('=')[1] for i in line_split}
-    node_name = node_attributes['NodeName']
-    node_states = node_attributes['State'].split('+')  # A node should have multiple states like IDLE+CLOUD+POWER
+def change_state(node_name, new_state, reason=None):
+    nodes_to_change.setdefault((new_state, reason), []).append(node_name)
+
+# State combinations matched below, built once instead of per node
+STATES_NOT_RESPONDING = frozenset(('DOWN*', 'IDLE*'))
+STATES_COMPLETING_DRAIN = frozenset(('COMPLETING', 'DRAIN'))
+
+# Inspect node states and change the state if required
+for node_name, node_states in nodes_states.items():  # A node should have multiple states like IDLE+CLOUD+POWER
 
     # Power down nodes that are stuck in DOWN* or IDLE* state (node is not responding)
-    if 'DOWN*' in node_states or 'IDLE*' in node_states:
+    if not node_states.isdisjoint(STATES_NOT_RESPONDING):
         change_state(node_name, 'POWER_DOWN', reason='node_not_responding')
 
-    # In some situations, a node may be placed in COMPLETING+DRAIN state by Slurm 
+    # In some situations, a node may be placed in COMPLETING+DRAIN state by Slurm
     # and remains stuck. In that case, force the node to become DOWN
-    if 'COMPLETING' in node_states and 'DRAIN' in node_states:
+    if node_states.issuperset(STATES_COMPLETING_DRAIN):
         change_state(node_name, 'DOWN', reason='node_stuck')
 
     # If the node is DOWN and in power saving mode, set the node to IDLE
@@ -58,3 +95,15 @@ for line in lines:
     # If the node is in power saving mode but still draining, set the node to UNDRAIN
     if 'DRAIN' in node_states and 'POWER' in node_states:
         change_state(node_name, 'UNDRAIN')
+
+# Apply the state changes, one scontrol call per (state, reason) group
+for (new_state, reason), node_names in nodes_to_change.items():
+    node_list = ','.join(node_names)
+    try:
+        slurm_param = ['state=%s' %new_state]
+        if reason is not None:
+            slurm_param.append('reason=%s' %reason)
+        common.update_node(node_list, slurm_param)
+        logger.info('Set node %s to state %s', node_list, new_state)
+    except Exception as e:
+        logger.error('Failed to set node %s to state %s - %s', node_list, new_state, e)
@@ -1,11 +1,22 @@
 import json
 import logging
+import logging.handlers
 import os
 import re
+import shlex
 import subprocess
 import sys
+import threading
 
 import boto3
+import botocore.config
+
+# Use orjson to parse JSON files when it is available: it is noticeably faster
+# than the standard json module. Fall back to json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 dir_path = os.path.dirname(os.path.realpath(__file__))  # Folder where resides the Python files
@@ -15,6 +26,12 @@ config = None  # Global variable for the config parameters
 partitions = None  # Global variable that stores partitions details
 
 
+# Formatters are stateless and shared by every logger, so build them once at
+# import time instead of once per get_logger call
+_SH_FORMATTER = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_FH_FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
 # Create and return a logging.Logger object
 # - scriptname: name of the module
 # - levelname: log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
@@ -23,54 +40,60 @@ def get_logger(scriptname, levelname, filename):
     
     logger = logging.getLogger(scriptname)
     
-    # Update log level
-    log_levels = {
-        'DEBUG': logging.DEBUG,
-        'INFO': logging.INFO,
-        'WARNING': logging.WARNING,
-        'ERROR': logging.ERROR,
-        'CRITICAL': logging.CRITICAL
-    }
-    logger.setLevel(log_levels.get(levelname, logging.DEBUG))
-    
+    # Update log level. getLevelName returns the numeric level for a valid
+    # name, and a placeholder string otherwise
+    level = logging.getLevelName(levelname)
+    logger.setLevel(level if isinstance(level, int) else logging.DEBUG)
+
+    # Do not attach handlers again if this logger is already configured:
+    # duplicate handlers would write every record twice to the console and file
+    if logger.handlers:
+        return logger
+
     # Create a console handler
     sh = logging.StreamHandler()
-    sh_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    sh.setFormatter(sh_formatter)
+    sh.setFormatter(_SH_FORMATTER)
     logger.addHandler(sh)
     
-    # Create a file handler
-    fh = logging.FileHandler(filename)
-    fh_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh.setFormatter(fh_formatter)
-    logger.addHandler(fh)
-    
+    # Create a file handler. Records are buffered in memory and written to the
+    # file in batches to reduce the number of write syscalls: the buffer is
+    # flushed when full, on any ERROR or above, and at interpreter shutdown
+    fh = logging.FileHandler(filename, delay=True)
+    fh.setFormatter(_FH_FORMATTER)
+    mh = logging.handlers.MemoryHandler(64, flushLevel=logging.ERROR, target=fh)
+    logger.addHandler(mh)
+
     return logger
     
 
+# Allowed values and required keys used by the validation functions, built
+# once at import time instead of per validation call
+VALID_LOG_LEVELS = frozenset(('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'))
+VALID_PURCHASING_OPTIONS = frozenset(('spot', 'on-demand'))
+REQUIRED_SLURM_CONF_KEYS = ('PrivateData', 'ResumeProgram', 'SuspendProgram', 'ResumeRate',
+                            'SuspendRate', 'ResumeTimeout', 'SuspendTime', 'TreeWidth')
+
+# Pattern for valid partition and node group names, compiled once
+NAME_PATTERN = re.compile('^[a-zA-Z0-9]+$')
+
+
 # Validate the structure of the config.json file content
 # - data: dict loaded from config.json
 def validate_config(data):
-    
+
     assert 'LogLevel' in data, 'Missing "LogLevel" in root'
-    assert data['LogLevel'] in ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'), 'root["LogLevel"] is an invalid value'
-    
+    assert data['LogLevel'] in VALID_LOG_LEVELS, 'root["LogLevel"] is an invalid value'
+
     assert 'LogFileName' in data, 'Missing "LogFileName" in root'
-    
+
     assert 'SlurmBinPath' in data, 'Missing "SlurmBinPath" in root'
-    
+
     assert 'SlurmConf' in data, 'Missing "SlurmConf" in root'
     slurm_conf = data['SlurmConf']
     assert isinstance(slurm_conf, dict), 'root["SlurmConf"] is not a dict'
-    
-    assert 'PrivateData' in slurm_conf, 'Missing "PrivateData" in root["SlurmConf"]'
-    assert 'ResumeProgram' in slurm_conf, 'Missing "ResumeProgram" in root["SlurmConf"]'
-    assert 'SuspendProgram' in slurm_conf, 'Missing "SuspendProgram" in root["SlurmConf"]'
-    assert 'ResumeRate' in slurm_conf, 'Missing "ResumeRate" in root["SlurmConf"]'
-    assert 'SuspendRate' in slurm_conf, 'Missing "SuspendRate" in root["SlurmConf"]'
-    assert 'ResumeTimeout' in slurm_conf, 'Missing "ResumeTimeout" in root["SlurmConf"]'
-    assert 'SuspendTime' in slurm_conf, 'Missing "SuspendTime" in root["SlurmConf"]'
-    assert 'TreeWidth' in slurm_conf, 'Missing "TreeWidth" in root["SlurmConf"]'
+
+    for key in REQUIRED_SLURM_CONF_KEYS:
+        assert key in slurm_conf, 'Missing "%s" in root["SlurmConf"]' %key
     
     
 # Validate the structure of the partitions.json file content
@@ -82,14 +105,14 @@ def validate_partitions(data):
     
     for i_partition, partition in enumerate(data['Partitions']):
         assert 'PartitionName' in partition, 'Missing "PartitionName" in root["Partitions"][%s]' %i_partition
-        assert re.match('^[a-zA-Z0-9]+$', partition['PartitionName']), 'root["Partitions"][%s]["PartitionName"] does not match ^[a-zA-Z0-9]+$' %i_partition
+        assert NAME_PATTERN.match(partition['PartitionName']), 'root["Partitions"][%s]["PartitionName"] does not match ^[a-zA-Z0-9]+$' %i_partition
         
         assert 'NodeGroups' in partition, 'Missing "NodeGroups" in root["Partitions"][%s]' %i_partition
         assert isinstance(partition['NodeGroups'], list), 'root["Partitions"][%s]["NodeGroups"] is not an array' %i_partition
         
         for i_nodegroup, nodegroup in enumerate(partition['NodeGroups']):
             assert 'NodeGroupName' in nodegroup, 'Missing "NodeGroupName" in root["Partitions"][%s]["NodeGroups"][%s]' %(i_partition, i_nodegroup)
-            assert re.match('^[a-zA-Z0-9]+$', nodegroup['NodeGroupName']), 'root["Partitions"][%s]["NodeGroups"][%s]["NodeGroupName"] does not match ^[a-zA-Z0-9]+$' %(i_partition, i_nodegroup)
+            assert NAME_PATTERN.match(nodegroup['NodeGroupName']), 'root["Partitions"][%s]["NodeGroups"][%s]["NodeGroupName"] does not match ^[a-zA-Z0-9]+$' %(i_partition, i_nodegroup)
             
             assert 'MaxNodes' in nodegroup, 'Missing "MaxNodes" in root["Partitions"][%s]["NodeGroups"][%s]' %(i_partition, i_nodegroup)
             assert isinstance(nodegroup['MaxNodes'], int), 'root["Partitions"][%s]["NodeGroups"][%s]["MaxNodes"] is not a number' %(i_partition, i_nodegroup)
@@ -100,7 +123,7 @@ def validate_partitions(data):
             assert isinstance(nodegroup['SlurmSpecifications'], dict), 'root["Partitions"][%s]["NodeGroups"][%s]["SlurmSpecifications"] is not a dict' %(i_partition, i_nodegroup)
             
             assert 'PurchasingOption' in nodegroup, 'Missing "PurchasingOption" in root["Partitions"][%s]["NodeGroups"][%s]' %(i_partition, i_nodegroup)
-            assert nodegroup['PurchasingOption'] in ('spot', 'on-demand'), 'root["Partitions"][%s]["NodeGroups"][%s]["PurchasingOption"] must be spot or on-demand' %(i_partition, i_nodegroup)
+            assert nodegroup['PurchasingOption'] in VALID_PURCHASING_OPTIONS, 'root["Partitions"][%s]["NodeGroups"][%s]["PurchasingOption"] must be spot or on-demand' %(i_partition, i_nodegroup)
             
             assert 'LaunchTemplateSpecification' in nodegroup, 'Missing "LaunchTemplateSpecification" in root["Partitions"][%s]["NodeGroups"][%s]' %(i_partition, i_nodegroup)
             assert isinstance(nodegroup['LaunchTemplateSpecification'], dict), 'root["Partitions"][%s]["NodeGroups"][%s]["LaunchTemplateSpecification"] is not a dict' %(i_partition, i_nodegroup)
@@ -115,20 +138,81 @@ def validate_partitions(data):
             assert isinstance(partition['PartitionOptions'], dict), 'root["Partitions"][%s]["PartitionOptions"] is not a dict' %(i_partition)
 
             
+# Load and parse a JSON file, with orjson when available
+# - filename: path of the JSON file
+def load_json_file(filename):
+
+    if orjson is not None:
+        with open(filename, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+# Serialize an object to a compact JSON string for log records, with orjson
+# when available. Non-serializable values (e.g. datetimes in EC2 responses)
+# are stringified instead of raising
+# - data: object to serialize
+def dump_json(data):
+
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode()
+    return json.dumps(data, default=str)
+
+
+_COMMON_CACHE = {}  # Cache of (logger, config, partitions) keyed on script name and file stats
+_VALIDATED_KEYS = set()  # File cache keys whose content already passed validation
+
+
+# Return a cache key for a file based on its path, size and modification time
+# so that the cached content is discarded when the file changes
+def _get_file_cache_key(filename):
+
+    try:
+        st = os.stat(filename)
+        return (filename, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (filename, None, None)
+
+
 # Create and return logger, config, and partitions variables
 def get_common(scriptname):
-    
+
     global logger
     global config
     global partitions
-    
+
+    # The configuration can be handed over through the environment by a caller
+    # that already loaded it (e.g. a wrapper invoking several hooks), which
+    # avoids re-reading config.json in every subprocess
+    config_env = os.environ.get('SLURM_AWS_PLUGIN_CONFIG')
+
+    # Return cached values if config.json and partitions.json have not changed
+    # since they were last loaded and validated in this process
+    if config_env is not None:
+        config_key = ('env', hash(config_env))
+    else:
+        config_key = _get_file_cache_key('%s/config.json' %dir_path)
+    partitions_key = _get_file_cache_key('%s/partitions.json' %dir_path)
+    cache_key = (scriptname, config_key, partitions_key)
+    if cache_key in _COMMON_CACHE:
+        logger, config, partitions = _COMMON_CACHE[cache_key]
+        return logger, config, partitions
+
     # Load configuration parameters from ./config.json and merge with default values
+    # The file is opened and parsed only once: on failure, carry the error forward
+    # so it can be logged once the logger exists
+    config_filename = '%s/config.json' %dir_path
+    json_load_error = None
     try:
-        config_filename = '%s/config.json' %dir_path
-        with open(config_filename, 'r') as f:
-            config = json.load(f)
+        if config_env is not None:
+            config_filename = 'SLURM_AWS_PLUGIN_CONFIG environment variable'
+            config = orjson.loads(config_env) if orjson is not None else json.loads(config_env)
+        else:
+            config = load_json_file(config_filename)
     except Exception as e:
-        config = {'JsonLoadError': str(e)}
+        config = {}
+        json_load_error = str(e)
 
     # Populate default values if unspecified
     if not 'LogFileName' in config:
@@ -142,37 +226,49 @@ def get_common(scriptname):
     
     # Create a logger
     logger = get_logger(scriptname, config['LogLevel'], config['LogFileName'])
-    logger.debug('Config: %s' %json.dumps(config, indent=4))
+    # Serialize the config for the debug record only when DEBUG is enabled
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Config: %s', dump_json(config))
     
     # Validate the structure of config.json
-    if 'JsonLoadError' in config:
-        logger.critical('Failed to load %s - %s' %(config['LogFileName'], config['JsonLoadError']))
-        sys.exit(1)
-    try:
-        validate_config(config)
-    except Exception as e:
-        logger.critical('File config.json is invalid - %s' %e)
+    if json_load_error is not None:
+        logger.critical('Failed to load %s - %s', config_filename, json_load_error)
         sys.exit(1)
+    # Skip validation when this exact file content already passed it, e.g. for
+    # a previous call under a different script name
+    if config_key not in _VALIDATED_KEYS:
+        try:
+            validate_config(config)
+        except Exception as e:
+            logger.critical('File config.json is invalid - %s', e)
+            sys.exit(1)
+        _VALIDATED_KEYS.add(config_key)
 
     # Load partitions details from ./partitions.json
     partitions_filename = '%s/partitions.json' %dir_path
     try:
-        with open(partitions_filename, 'r') as f:
-            partitions_json = json.load(f)
+        partitions_json = load_json_file(partitions_filename)
     except Exception as e:
-        logger.critical('Failed to load %s - %s' %(partitions_filename, e))
+        logger.critical('Failed to load %s - %s', partitions_filename, e)
         sys.exit(1)
         
-    # Validate the structure of partitions.json
+    # Validate the structure of partitions.json, unless this exact file
+    # content already passed validation
     try:
-        validate_partitions(partitions_json)
+        if partitions_key not in _VALIDATED_KEYS:
+            validate_partitions(partitions_json)
+            _VALIDATED_KEYS.add(partitions_key)
     except Exception as e:
-        logger.critical('File partition.json is invalid - %s' %e)
+        logger.critical('File partition.json is invalid - %s', e)
         sys.exit(1)
     finally:
         partitions = partitions_json['Partitions']
-        logger.debug('Partitions: %s' %json.dumps(partitions_json, indent=4))
-    
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Partitions: %s', dump_json(partitions_json))
+
+    # Cache the validated values for subsequent calls in the same process
+    _COMMON_CACHE[cache_key] = (logger, config, partitions)
+
     return logger, config, partitions
 
 
@@ -213,17 +309,56 @@ def get_node_range(partition, nodegroup, nb_nodes=None):
         return '%s-0' %(get_node_name(partition, nodegroup))
 
 
+_CMD_PATH_CACHE = {}  # Cache of absolute command paths keyed on command name
+
+
 # Run scontrol and return output
+# shlex.join renders a copy-pasteable command line but only exists from
+# Python 3.8: fall back to a plain join on older interpreters (Amazon Linux 2
+# ships Python 3.7)
+try:
+    _shlex_join = shlex.join
+except AttributeError:
+    _shlex_join = ' '.join
+
+
 # - command: name of the command such as scontrol
 # - arguments: array
 def run_scommand(command, arguments):
-    
-    scommand_path = '%s%s' %(config['SlurmBinPath'], command)
+
+    try:
+        scommand_path = _CMD_PATH_CACHE[command]
+    except KeyError:
+        scommand_path = _CMD_PATH_CACHE.setdefault(command, '%s%s' %(config['SlurmBinPath'], command))
     cmd = [scommand_path] + arguments
-    logger.debug('Command %s: %s' %(command, ' '.join(cmd)))
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    lines = proc.communicate()[0].splitlines()
-    return [line.decode() for line in lines]
+    # Only render the command line when DEBUG records are actually emitted:
+    # shlex.join produces a copy-pasteable command but is not free
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Command %s: %s', command, _shlex_join(cmd))
+    # Read stdout line by line as the command produces it, rather than
+    # buffering the entire output and splitting it afterwards
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    with proc.stdout:
+        lines = [line.rstrip('\n') for line in proc.stdout]
+    proc.wait()
+    return lines
+
+
+# Run several scontrol commands through a single interactive scontrol process
+# to avoid the cost of one fork/exec per command
+# - commands: list of command strings such as 'update nodename=node0 nodeaddr=10.0.0.1'
+def run_scontrol_batch(commands):
+
+    if len(commands) == 0:
+        return []
+
+    try:
+        scontrol_path = _CMD_PATH_CACHE['scontrol']
+    except KeyError:
+        scontrol_path = _CMD_PATH_CACHE.setdefault('scontrol', '%sscontrol' %config['SlurmBinPath'])
+    logger.debug('Batch of %s scontrol commands: %s', len(commands), commands)
+    proc = subprocess.run([scontrol_path], input='%s\n' %'\n'.join(commands), stdout=subprocess.PIPE, text=True)
+    return proc.stdout.splitlines()
 
 
 # Use 'scontrol show hostnames' to expand the hostlist and return a list of node names
@@ -234,18 +369,22 @@ def expand_hostlist(hostlist):
         arguments = ['show', 'hostnames', hostlist]
         return run_scommand('scontrol', arguments)
     except Exception as e:
-        logger.critical('Failed to expand hostlist - %s' %e)
+        logger.critical('Failed to expand hostlist - %s', e)
         sys.exit(1)
 
 
+# Pattern of a node name [partition_name]-[nodegroup_name]-[id], compiled once
+# instead of per node name
+NODE_NAME_PATTERN = re.compile('^([a-zA-Z0-9]+)-([a-zA-Z0-9]+)-([0-9]+)$')
+
+
 # Take a list of node names in input and return a dict with result[partition_name][nodegroup_name] = list of node ids
 def parse_node_names(node_names):
     result = {}
     for node_name in node_names:
-        
+
         # For each node: extract partition name, node group name and node id
-        pattern = '^([a-zA-Z0-9]+)-([a-zA-Z0-9]+)-([0-9]+)$'
-        match = re.match(pattern, node_name)
+        match = NODE_NAME_PATTERN.match(node_name)
         if match:
             partition_name, nodegroup_name, node_id = match.groups()
             
@@ -259,24 +398,36 @@ def parse_node_names(node_names):
     return result
 
 
+_NODEGROUP_INDEX = None  # Node groups keyed on (partition_name, nodegroup_name)
+
+
 # Return a pointer in partitions to a specific partition and node group
 def get_partition_nodegroup(partition_name, nodegroup_name):
-    
-    for partition in partitions:
-        if partition['PartitionName'] == partition_name:
+
+    global _NODEGROUP_INDEX
+
+    # Index the partitions once so each lookup is O(1) instead of scanning
+    # every partition and node group. Build into a local dict and publish it
+    # with a single assignment: this runs on thread-pool workers, which must
+    # never observe a partially filled index
+    if _NODEGROUP_INDEX is None:
+        index = {}
+        for partition in partitions or ():
             for nodegroup in partition['NodeGroups']:
-                if nodegroup['NodeGroupName'] == nodegroup_name:
-                    return nodegroup
-    
+                index[(partition['PartitionName'], nodegroup['NodeGroupName'])] = nodegroup
+        _NODEGROUP_INDEX = index
+
     # Return None if it does not exist
-    return None
+    return _NODEGROUP_INDEX.get((partition_name, nodegroup_name))
 
 
 # Use 'scontrol update node' to update nodes
+# - parameters: list of 'key=value' strings, or a space-separated string
 def update_node(node_name, parameters):
-    
-    parameters_split = parameters.split(' ')
-    arguments = ['update', 'nodename=%s' %node_name] + parameters_split
+
+    if isinstance(parameters, str):
+        parameters = parameters.split(' ')
+    arguments = ['update', 'nodename=%s' %node_name] + parameters
     run_scommand('scontrol', arguments)
     
     
@@ -287,19 +438,53 @@ def get_node_state(hostlist):
         cmd = [scontrol_path, '-n', ','.join(hostlist), '-N', '-o', '"%N %t"']
         return run_scommand('sinfo', arguments)
     except Exception as e:
-        logger.critical('Failed to retrieve node state - %s' %e)
+        logger.critical('Failed to retrieve node state - %s', e)
         sys.exit(1)
 
 
+# Client configuration shared by all EC2 clients. Adaptive retry mode shapes
+# the request rate to observed throttling instead of blindly retrying, and the
+# larger connection pool keeps concurrent node group workers from queuing on
+# HTTPS connections
+BOTO_CONFIG = botocore.config.Config(
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    connect_timeout=5,
+    read_timeout=15,
+    max_pool_connections=64,
+    tcp_keepalive=True
+)
+
+_EC2_CLIENT_CACHE = {}  # EC2 clients keyed on (region, profile): boto3 clients are thread-safe
+_EC2_CLIENT_LOCK = threading.Lock()  # Serializes client creation across pool workers
+
+
 # Return boto3 client
 def get_ec2_client(nodegroup):
-    
-    if 'ProfileName' in nodegroup:
-        try:
-            session = boto3.session.Session(region_name=nodegroup['Region'], profile_name=nodegroup['ProfileName'])
-            return session.client('ec2')
-        except Exception as e:
-            logger.critical('Failed to create a EC2 client - %s' %e)
-            sys.exit(1)
-    else:
-        return boto3.client('ec2', region_name=nodegroup['Region'])
+
+    region = nodegroup['Region']
+    profile = nodegroup.get('ProfileName')
+    client = _EC2_CLIENT_CACHE.get((region, profile))
+    if client is not None:
+        return client
+
+    # Using a client is thread-safe but creating one is not: it lazily builds
+    # and mutates shared boto3 session state, and this runs on thread-pool
+    # workers. Serialize creation and re-check the cache under the lock
+    with _EC2_CLIENT_LOCK:
+        client = _EC2_CLIENT_CACHE.get((region, profile))
+        if client is not None:
+            return client
+
+        if profile is not None:
+            try:
+                session = boto3.session.Session(region_name=region, profile_name=profile)
+                client = session.client('ec2', config=BOTO_CONFIG)
+            except Exception as e:
+                logger.critical('Failed to create a EC2 client - %s', e)
+                sys.exit(1)
+        else:
+            client = boto3.client('ec2', region_name=region, config=BOTO_CONFIG)
+
+        _EC2_CLIENT_CACHE[(region, profile)] = client
+
+    return client
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
+import concurrent.futures
 import copy
-import json
+import logging
 import re
 import sys
 import time
@@ -11,6 +12,11 @@ import common
 logger, config, partitions = common.get_common('resume')
 
 
+# AWS error codes worth retrying here: eventual consistency can make freshly
+# launched instances invisible to the first describe or tag call
+RETRYABLE_ERROR_CODES = frozenset(('InvalidInstanceID.NotFound',))
+
+
 # Retry in case the request failed because of eventual consistency
 def retry(func, *args, **kwargs):
     nb_retry = 1
@@ -19,167 +25,224 @@ def retry(func, *args, **kwargs):
         try:
             return func(*args, **kwargs)
         except Exception as e:
+            # Fail fast on AWS errors that waiting will not fix: throttling
+            # and transient faults are already retried by botocore itself
+            response = getattr(e, 'response', None)
+            if response is not None:
+                error_code = response.get('Error', {}).get('Code')
+                if error_code is not None and error_code not in RETRYABLE_ERROR_CODES:
+                    raise e
             if nb_retry <= MAX_RETRIES:
                 logger.debug('Failed %s %d time(s): %s', func.__name__, nb_retry, e)
+                # Back off exponentially (1s, 2s, 4s) between attempts
+                time.sleep(2 ** (nb_retry - 1))
                 nb_retry += 1
-                time.sleep(nb_retry)
             else:
                 raise e
 
 
+# Launch the instances for a node group and register them with Slurm
+# - partition_name, nodegroup_name: identify the node group in partitions.json
+# - node_ids: list of node ids to resume for this node group
+def resume_nodegroup(partition_name, nodegroup_name, node_ids):
+
+    nb_nodes_to_resume = len(node_ids)
+
+    # Nothing to launch for an empty node list: skip the EC2 calls entirely
+    if nb_nodes_to_resume == 0:
+        return
+
+    nodegroup = common.get_partition_nodegroup(partition_name, nodegroup_name)
+
+    # Ignore if the partition and the node group are not in partitions.json
+    if nodegroup is None:
+        logger.warning('Skipping partition=%s nodegroup=%s: not in partition.json', partition_name, nodegroup_name)
+        return
+
+    client = common.get_ec2_client(nodegroup)
+
+    # Create a dict for the EC2 CreateFleet request
+    request_fleet = {
+        'LaunchTemplateConfigs': [
+            {
+                'LaunchTemplateSpecification': nodegroup['LaunchTemplateSpecification'],
+                'Overrides': []
+            }
+        ],
+        'TargetCapacitySpecification': {
+            'TotalTargetCapacity': nb_nodes_to_resume,
+            'DefaultTargetCapacityType': nodegroup['PurchasingOption']
+        },
+        'Type': 'instant'
+    }
+
+    # Populate on-demand options
+    if 'OnDemandOptions' in nodegroup:
+        request_fleet['OnDemandOptions'] = nodegroup['OnDemandOptions']
+
+    # Populate spot options
+    if 'SpotOptions' in nodegroup:
+        request_fleet['SpotOptions'] = nodegroup['SpotOptions']
+        request_fleet['SpotOptions']['InstanceInterruptionBehavior'] = 'terminate'
+
+    # Populate launch configuration overrides. Duplicate overrides for each
+    # subnet. Bind the nested structures to locals once instead of chasing the
+    # same dict path on every iteration
+    overrides = request_fleet['LaunchTemplateConfigs'][0]['Overrides']
+    subnet_ids = nodegroup['SubnetIds']
+    for override in nodegroup['LaunchTemplateOverrides']:
+        for subnet in subnet_ids:
+            override_copy = copy.deepcopy(override)
+            override_copy['SubnetId'] = subnet
+            override_copy['WeightedCapacity'] = 1
+            overrides.append(override_copy)
+
+    # Create an EC2 fleet
+    # Serialize the request and response payloads only when DEBUG records
+    # are actually emitted
+    try:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('EC2 CreateFleet request: %s', common.dump_json(request_fleet))
+        response_fleet = client.create_fleet(**request_fleet)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('EC2 CreateFleet response: %s', common.dump_json(response_fleet))
+    except Exception as e:
+        logger.error('Failed to launch nodes for partition=%s and nodegroup=%s - %s', partition_name, nodegroup_name, e)
+        return
+
+    # This variable will be used as an incremental index of node_ids
+    node_id_index = 0
+
+    # Slurm node updates accumulated for a single batched scontrol call
+    slurm_update_commands = []
+
+    # Tag template for the node group, built once. Per-instance values are
+    # substituted into fresh copies so the template is never mutated
+    base_tags = [
+        {
+            'Key': 'Name',
+            'Value': '{node_name}'
+        }
+    ]
+    if 'Tags' in nodegroup:
+        base_tags += nodegroup['Tags']
+
+    # Collect all instances that were successfully launched across the fleet
+    # entries, then retrieve their details with a single describe call
+    all_instance_ids = []
+    for instance in response_fleet['Instances']:
+        all_instance_ids += instance['InstanceIds']
+
+    # Project the verbose describe output down to the only field used, so
+    # the full response can be garbage-collected right away
+    ip_addresses = {}
+    if len(all_instance_ids) > 0:
+        try:
+            response_describe = retry(client.describe_instances, InstanceIds=all_instance_ids)
+            for reservation in response_describe['Reservations']:
+                for instance_details in reservation['Instances']:
+                    ip_addresses[instance_details['InstanceId']] = instance_details['PrivateIpAddress']
+        except Exception as e:
+            logger.error('Failed to describe instances %s: %s', ', '.join(all_instance_ids), e)
+
+    # For each instance that was successfully launched
+    for instance_id in all_instance_ids:
+        node_id = node_ids[node_id_index]
+        node_id_index += 1
+        node_name = common.get_node_name(partition_name, nodegroup_name, node_id)
+
+        # Isolate details for the current instance
+        ip_address = ip_addresses.get(instance_id)
+        if ip_address is None:
+            logger.error('Missing description for instance %s', instance_id)
+            continue
+        hostname = 'ip-%s' %'-'.join(ip_address.split('.'))
+
+        logger.info('Launched node %s %s %s', node_name, instance_id, ip_address)
+
+        # Tag the instance. Replace the following sequences with context
+        # values, for example {ip_address} with the private IP address
+        sequences = (
+            ('{ip_address}', ip_address),
+            ('{node_name}', node_name),
+            ('{hostname}', hostname)
+        )
+        tags = []
+        for tag in base_tags:
+            value = tag['Value']
+            for sequence in sequences:
+                value = value.replace(*sequence)
+            tags.append({'Key': tag['Key'], 'Value': value})
+
+        try:
+            request_tags = {
+                'Resources': [instance_id],
+                'Tags': tags
+            }
+            retry(client.create_tags, **request_tags)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Tagged node %s: %s', node_name, common.dump_json(request_tags))
+        except Exception as e:
+            logger.error('Failed to tag node %s - %s', node_name, e)
+            continue
+
+        # Queue the node information update, applied in a single batch below
+        slurm_update_commands.append('update nodename=%s nodeaddr=%s nodehostname=%s' %(node_name, ip_address, hostname))
+
+    # Update node information in Slurm with a single scontrol process
+    try:
+        common.run_scontrol_batch(slurm_update_commands)
+        logger.debug('Updated node information in Slurm for %s node(s)', len(slurm_update_commands))
+    except Exception as e:
+        logger.error('Failed to update node information in Slurm - %s', e)
+
+    # Log how many nodes failed to launch
+    nb_failed_nodes = nb_nodes_to_resume - node_id_index
+    if nb_failed_nodes > 0:
+        logger.warning('Failed to launch %s nodes', nb_failed_nodes)
+
+    # Log EC2 fleet errors
+    error_codes = set()
+    for error in response_fleet['Errors']:
+        override = error['LaunchTemplateAndOverrides']['Overrides']
+        logger.debug('EC2 Fleet error - %s - Instance type: %s Subnet: %s Lifecycle: %s',
+                     error['ErrorMessage'], override['InstanceType'], override['SubnetId'],
+                     error['Lifecycle'])
+        error_codes.add(error['ErrorCode'])
+
+    if len(error_codes) > 0:
+        logger.warning('EC2 Fleet error codes: %s', ', '.join(sorted(error_codes)))
+
+
 # Retrieve the list of hosts to resume
 try:
     hostlist = sys.argv[1]
-    logger.info('Hostlist: %s' %hostlist)
+    logger.info('Hostlist: %s', hostlist)
 except:
     logger.critical('Missing hostlist argument')
     sys.exit(1)
 
 # Expand the hoslist and retrieve a list of node names
 expanded_hostlist = common.expand_hostlist(hostlist)
-logger.debug('Expanded hostlist: %s' %', '.join(expanded_hostlist))
+logger.debug('Expanded hostlist: %s', expanded_hostlist)
 
 # Parse the expanded hostlist
 nodes_to_resume = common.parse_node_names(expanded_hostlist)
-logger.debug('Nodes to resume: %s', json.dumps(nodes_to_resume, indent=4))
-
-for partition_name, nodegroups in nodes_to_resume.items():
-    for nodegroup_name, node_ids in nodegroups.items():
-        
-        nb_nodes_to_resume = len(node_ids)
-        nodegroup = common.get_partition_nodegroup(partition_name, nodegroup_name)
-        
-        # Ignore if the partition and the node group are not in partitions.json
-        if nodegroup is None:
-            logger.warning('Skipping partition=%s nodegroup=%s: not in partition.json' %(partition_name, nodegroup_name))
-            continue
-        
-        client = common.get_ec2_client(nodegroup)
-
-        # Create a dict for the EC2 CreateFleet request
-        request_fleet = {
-            'LaunchTemplateConfigs': [
-                {
-                    'LaunchTemplateSpecification': nodegroup['LaunchTemplateSpecification'],
-                    'Overrides': []
-                }
-            ],
-            'TargetCapacitySpecification': {
-                'TotalTargetCapacity': nb_nodes_to_resume,
-                'DefaultTargetCapacityType': nodegroup['PurchasingOption']
-            },
-            'Type': 'instant'
-        }
-            
-        # Populate on-demand options
-        if 'OnDemandOptions' in nodegroup:
-            request_fleet['OnDemandOptions'] = nodegroup['OnDemandOptions']
-        
-        # Populate spot options
-        if 'SpotOptions' in nodegroup:
-            request_fleet['SpotOptions'] = nodegroup['SpotOptions']
-            request_fleet['SpotOptions']['InstanceInterruptionBehavior'] = 'terminate'
-            
-        # Populate launch configuration overrides. Duplicate overrides for each subnet
-        for override in nodegroup['LaunchTemplateOverrides']:
-            for subnet in nodegroup['SubnetIds']:
-                override_copy = copy.deepcopy(override)
-                override_copy['SubnetId'] = subnet
-                override_copy['WeightedCapacity'] = 1
-                request_fleet['LaunchTemplateConfigs'][0]['Overrides'].append(override_copy)
-
-        # Create an EC2 fleet
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug('Nodes to resume: %s', common.dump_json(nodes_to_resume))
+
+# Resume the node groups concurrently: each one is dominated by blocking EC2
+# calls, so overlapping them cuts wall time to the slowest node group
+with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+    futures = {}
+    for partition_name, nodegroups in nodes_to_resume.items():
+        for nodegroup_name, node_ids in nodegroups.items():
+            future = executor.submit(resume_nodegroup, partition_name, nodegroup_name, node_ids)
+            futures[future] = (partition_name, nodegroup_name)
+
+    for future in concurrent.futures.as_completed(futures):
+        partition_name, nodegroup_name = futures[future]
         try:
-            logger.debug('EC2 CreateFleet request: %s' %json.dumps(request_fleet, indent=4))
-            response_fleet = client.create_fleet(**request_fleet)
-            logger.debug('EC2 CreateFleet response: %s' %json.dumps(response_fleet, indent=4))
+            future.result()
         except Exception as e:
-            logger.error('Failed to launch nodes for partition=%s and nodegroup=%s - %s' %(partition_name, nodegroup_name, e))
-            continue
-        
-        # This variable will be used as an incremental index of node_ids
-        node_id_index = 0
-        
-        # For all instances that were successfully launched
-        for instance in response_fleet['Instances']:
-            
-            # Retrieve additional instance details
-            try:
-                response_describe = retry(client.describe_instances, InstanceIds=instance['InstanceIds'])
-            except Exception as e:
-                logger.error('Failed to describe instances %s: %s' %(', '.join(instance['InstanceIds']), e))
-                continue
-            
-            # For each instance that was successfully launched
-            for instance_id in instance['InstanceIds']:
-                node_id = node_ids[node_id_index]
-                node_id_index += 1
-                node_name = common.get_node_name(partition_name, nodegroup_name, node_id)
-                
-                # Isolate details for the current instance
-                for reservation in response_describe['Reservations']:
-                    for instance_details in reservation['Instances']:
-                        if instance_details['InstanceId'] == instance_id:
-                            ip_address = instance_details['PrivateIpAddress']
-                            hostname = 'ip-%s' %'-'.join(ip_address.split('.'))
-                            
-                logger.info('Launched node %s %s %s' %(node_name, instance_id, ip_address))
-                
-                # Tag the instance
-                tags = [
-                    {
-                        'Key': 'Name',
-                        'Value': '{node_name}'
-                    }
-                ]
-                if 'Tags' in nodegroup:
-                    tags += nodegroup['Tags']
-
-                # Replace the following sequences with context values
-                # For example, replace {ip_address} with the private IP address
-                sequences = (
-                    ('{ip_address}', ip_address),
-                    ('{node_name}', node_name),
-                    ('{hostname}', hostname)
-                )
-                for tag in tags:
-                    for sequence in sequences:
-                      tag['Value'] = tag['Value'].replace(*sequence)
-
-                try:
-                    request_tags = {
-                        'Resources': [instance_id],
-                        'Tags': tags
-                    }
-                    retry(client.create_tags, **request_tags)
-                    logger.debug('Tagged node %s: %s' %(node_name, json.dumps(request_tags, indent=4)))
-                except Exception as e:
-                    logger.error('Failed to tag node %s - %s' %(node_name, e))
-                    continue
-                
-                # Update node information in Slurm
-                try:
-                    slurm_param = 'nodeaddr=%s nodehostname=%s' %(ip_address, hostname)
-                    common.update_node(node_name, slurm_param)
-                    logger.debug('Updated node information in Slurm %s' %node_name)
-                except Exception as e:
-                    logger.error('Failed to update node information in Slurm %s - %s' %(node_name, e))
-
-        # Log how many nodes failed to launch
-        nb_failed_nodes = nb_nodes_to_resume - node_id_index
-        if nb_failed_nodes > 0:
-            logger.warning('Failed to launch %s nodes' %nb_failed_nodes)
-
-        # Log EC2 fleet errors
-        error_codes = []
-        for error in response_fleet['Errors']:
-            override = error['LaunchTemplateAndOverrides']['Overrides']
-            logger.debug('EC2 Fleet error - %s - Instance type: %s Subnet: %s Lifecycle: %s' %(
-                error['ErrorMessage'], override['InstanceType'], override['SubnetId'],
-                error['Lifecycle']
-            ))
-            if not error['ErrorCode'] in error_codes:
-                error_codes.append(error['ErrorCode'])
-
-        if len(error_codes) > 0:
-            logger.warning('EC2 Fleet error codes: %s' %', '.join(error_codes))
+            logger.error('Failed to resume partition=%s nodegroup=%s - %s', partition_name, nodegroup_name, e)
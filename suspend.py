@@ -1,5 +1,6 @@
 #!/usr/bin/python3
-import json
+import concurrent.futures
+import logging
 import sys
 
 import common
@@ -7,58 +8,120 @@ import common
 
 logger, config, partitions = common.get_common('suspend')
 
+# Instance states eligible for termination, defined once instead of being
+# rebuilt in every describe filter
+FILTER_INSTANCE_STATES = ('pending', 'running', 'shutting-down', 'stopping', 'stopped')
+
+# Maximum number of values accepted in a single describe_instances filter
+MAX_FILTER_VALUES = 200
+
+
+# Terminate the instances backing a list of node names, using one client
+# - nodegroup: any node group of the (region, profile) pair, used to build the client
+# - node_names: names of all nodes to terminate for this (region, profile) pair
+def suspend_node_names(nodegroup, node_names):
+
+    client = common.get_ec2_client(nodegroup)
+
+    # Retrieve the list of instances to terminate based on the tag Name.
+    # Paginate so that batches larger than one page are fully covered, and
+    # chunk the names to stay under the filter-value limit
+    reservations = []
+    try:
+        paginator = client.get_paginator('describe_instances')
+        for i in range(0, len(node_names), MAX_FILTER_VALUES):
+            for page in paginator.paginate(
+                Filters=[
+                    {'Name': 'tag:Name', 'Values': node_names[i:i+MAX_FILTER_VALUES]},
+                    {'Name': 'instance-state-name', 'Values': list(FILTER_INSTANCE_STATES)}
+                ]
+            ):
+                reservations += page['Reservations']
+    except Exception as e:
+        logger.critical('Failed to describe instances to terminate - %s', e)
+        # Propagate so the driver records the failure and exits non-zero:
+        # Slurm must not believe the suspend succeeded when nothing was
+        # terminated
+        raise
+
+    # Collect the instances to terminate with their node names
+    instance_ids = []
+    instance_node_names = {}
+    for reservation in reservations:
+        for instance in reservation['Instances']:
+            instance_id = instance['InstanceId']
+            instance_ids.append(instance_id)
+            for tag in instance['Tags']:
+                if tag['Key'] == 'Name':
+                    instance_node_names[instance_id] = tag['Value']
+
+    # Terminate all collected instances in a single API call
+    # (TerminateInstances accepts up to 1000 instance ids per request)
+    for i in range(0, len(instance_ids), 1000):
+        batch = instance_ids[i:i+1000]
+        try:
+            client.terminate_instances(InstanceIds=batch)
+            for instance_id in batch:
+                logger.info('Terminated instance %s %s', instance_node_names.get(instance_id), instance_id)
+        except Exception as e:
+            logger.error('Failed to terminate instances %s - %s', ', '.join(batch), e)
+
+
 # Retrieve the list of hosts to suspend
 try:
     hostlist = sys.argv[1]
-    logger.info('Hostlist: %s' %hostlist)
+    logger.info('Hostlist: %s', hostlist)
 except:
     logger.critical('Missing hostlist argument')
     sys.exit(1)
 
 # Expand the hoslist and retrieve a list of node names
 expanded_hostlist = common.expand_hostlist(hostlist)
-logger.debug('Expanded hostlist: %s' %', '.join(expanded_hostlist))
+logger.debug('Expanded hostlist: %s', expanded_hostlist)
 
 # Parse the expanded hostlist
 nodes_to_suspend = common.parse_node_names(expanded_hostlist)
-logger.debug('Nodes to suspend: %s', json.dumps(nodes_to_suspend, indent=4))
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug('Nodes to suspend: %s', common.dump_json(nodes_to_suspend))
 
+# Coalesce the node groups that share the same (region, profile) pair, so that
+# one worker issues a single describe/terminate sequence for all of them
+suspend_groups = {}
 for partition_name, nodegroups in nodes_to_suspend.items():
     for nodegroup_name, node_ids in nodegroups.items():
-        
+
+        # Nothing to terminate for an empty node list
+        if len(node_ids) == 0:
+            continue
+
         nodegroup = common.get_partition_nodegroup(partition_name, nodegroup_name)
 
         # Ignore if the partition and the node group are not in partitions.json
         if nodegroup is None:
-            logger.warning('Skipping partition=%s nodegroup=%s: not in partition.json' %(partition_name, nodegroup_name))
+            logger.warning('Skipping partition=%s nodegroup=%s: not in partition.json', partition_name, nodegroup_name)
             continue
 
-        client = common.get_ec2_client(nodegroup)
-        
-        # Retrieve the list of instances to terminate based on the tag Name
-        instances_to_terminate = [common.get_node_name(partition_name, nodegroup_name, i) for i in node_ids]
+        group_key = (nodegroup['Region'], nodegroup.get('ProfileName'))
+        group = suspend_groups.setdefault(group_key, (nodegroup, []))
+        group[1].extend(common.get_node_name(partition_name, nodegroup_name, i) for i in node_ids)
+
+# Suspend the groups concurrently: the describe and terminate calls are
+# blocking EC2 round-trips, so overlapping the groups cuts wall time
+nb_failed_groups = 0
+with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+    futures = {}
+    for group_key, (nodegroup, node_names) in suspend_groups.items():
+        future = executor.submit(suspend_node_names, nodegroup, node_names)
+        futures[future] = group_key
+
+    for future in concurrent.futures.as_completed(futures):
+        group_key = futures[future]
         try:
-            response_describe = client.describe_instances(
-                Filters=[
-                    {'Name': 'tag:Name', 'Values': instances_to_terminate},
-                    {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'shutting-down', 'stopping', 'stopped']}
-                ]
-            )
+            future.result()
         except Exception as e:
-            logger.critical('Failed to describe instances to terminate - %s' %e)
-        
-        # Terminate each instance
-        for reservation in response_describe['Reservations']:
-            for instance in reservation['Instances']:
-                instance_id = instance['InstanceId']
-                
-                try:
-                    for tag in instance['Tags']:
-                        if tag['Key'] == 'Name':
-                            node_name = tag['Value']
-                            
-                    client.terminate_instances(InstanceIds=[instance_id])
-                    logger.info('Terminated instance %s %s' %(node_name, instance_id))
-                except Exception as e:
-                    logger.info('Failed to terminate instance %s %s' %(node_name, instance_id))
-                
\ No newline at end of file
+            logger.error('Failed to suspend nodes in region=%s profile=%s - %s', group_key[0], group_key[1], e)
+            nb_failed_groups += 1
+
+# Exit non-zero if any group failed, so Slurm sees the SuspendProgram failure
+if nb_failed_groups > 0:
+    sys.exit(1)